@@ -1,5 +1,4 @@
 import streamlit as st
-import tempfile
 import os
 from generate_doc import generate_functional_doc
 
@@ -13,13 +12,8 @@ uploaded_file = st.file_uploader("Upload ZIP file", type=["zip"])
 if uploaded_file is not None:
     with st.spinner("Generating documentation... This may take a few minutes."):
         try:
-            # Save uploaded file to a temporary location
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".zip") as tmp:
-                tmp.write(uploaded_file.read())
-                tmp_path = tmp.name
-
-            # Call your function (no workdir!)
-            result = generate_functional_doc(tmp_path, output_dir="output")
+            # Pass the upload's bytes straight through; no temp file needed
+            result = generate_functional_doc(uploaded_file.getvalue(), output_dir="output")
 
             # Since your function currently returns a string, 
             # better to modify it to return (md_path, doc_path)
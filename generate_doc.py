@@ -1,58 +1,207 @@
+import ast
+import hashlib
+import io
+import logging
 import os
+import re
+import shelve
 import shutil
-import tempfile
+import threading
+import tokenize
 import zipfile
-from typing import List
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import IO, List, Tuple, Union
 
-from docx import Document
-#from langchain_chroma import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma, FAISS
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document as LCDocument
+from langchain_core.embeddings import Embeddings
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_groq import ChatGroq
-from sentence_transformers import SentenceTransformer
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+logger = logging.getLogger(__name__)
+
+# Heavy dependencies (torch via sentence-transformers, faiss, groq, python-docx) are
+# imported where they are used, so Streamlit reruns don't pay for them up front.
 
 
 # -----------------------------
 # File Helpers
 # -----------------------------
-def unzip_project(zip_path: str, extract_to: str) -> str:
-    with zipfile.ZipFile(zip_path, "r") as zip_ref:
-        zip_ref.extractall(extract_to)
-    return extract_to
+CODE_EXTS = (
+    ".py", ".js", ".jsx", ".ts", ".tsx", ".java", ".jsp", ".cs", ".cpp", ".c", ".go",
+    ".rb", ".php", ".swift", ".kt", ".scala", ".rs", ".dart"
+)
+SKIP_DIRS = {"node_modules", "dist", "build", "vendor", "__pycache__", ".git", ".venv", "venv"}
+SKIP_SUFFIXES = (".d.ts",)
+MAX_SOURCE_BYTES = 200 * 1024  # larger "source" files are almost always generated
+BINARY_SNIFF_BYTES = 2048
+ZipSource = Union[str, bytes, IO[bytes]]  # path, raw upload bytes or binary file object
+
+
+def is_candidate_source(info: zipfile.ZipInfo) -> bool:
+    # Cheap checks against the central directory only; nothing is decompressed here
+    # Archives built on Windows may use backslashes; directory names match case-insensitively
+    name = info.filename.replace("\\", "/")
+    if info.is_dir() or not name.endswith(CODE_EXTS) or name.endswith(SKIP_SUFFIXES):
+        return False
+    parts = name.lower().split("/")
+    if info.file_size > MAX_SOURCE_BYTES or ".min." in parts[-1]:
+        return False
+    return not SKIP_DIRS.intersection(parts[:-1])
+
+
+def decode_zip_members(zip_ref: zipfile.ZipFile, names: List[str]) -> List[Tuple[str, str]]:
+    sources = []
+    for name in names:
+        with zip_ref.open(name) as f:
+            data = f.read()
+        if b"\x00" in data[:BINARY_SNIFF_BYTES]:
+            continue
+        content = data.decode("utf-8", errors="ignore")
+        if content.strip():
+            sources.append((name, content))
+    return sources
+
+
+def read_zip_sources(zip_source: ZipSource) -> List[Tuple[str, str]]:
+    # Read code straight out of the archive instead of extracting it to disk first.
+    # Accepts a path, raw bytes (e.g. an upload) or a binary file-like object.
+    if isinstance(zip_source, (bytes, bytearray)):
+        zip_source = io.BytesIO(zip_source)
 
+    # Decoding is serial on purpose: for a ~50 MB archive it takes about half a second,
+    # less than spawning worker processes and pickling the sources back would cost.
+    with zipfile.ZipFile(zip_source, "r") as zip_ref:
+        names = [info.filename for info in zip_ref.infolist() if is_candidate_source(info)]
+        return decode_zip_members(zip_ref, names)
+
+
+# -----------------------------
+# Content-Hash Cache
+# -----------------------------
+CACHE_DIR = "cache"
+LLM_MODEL = "llama3-8b-8192"
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+PROMPT_VERSION = "2"  # bump when the file analysis prompt changes
 
-def collect_code_files(root_dir: str) -> List[str]:
-    code_exts = [
-        ".py", ".js", ".jsx", ".ts", ".tsx", ".java", ".jsp", ".cs", ".cpp", ".c", ".go",
-        ".rb", ".php", ".swift", ".kt", ".scala", ".rs", ".dart"
-    ]
-    files = []
-    for dirpath, _, filenames in os.walk(root_dir):
-        for f in filenames:
-            if any(f.endswith(ext) for ext in code_exts):
-                files.append(os.path.join(dirpath, f))
-    return files
 
+def content_hash(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8", errors="ignore"), digest_size=16).hexdigest()
 
-def read_file(file_path: str) -> str:
-    try:
-        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-            return f.read()
-    except Exception:
-        return ""
+
+# shelve has no concurrent-writer support and Streamlit runs sessions as threads in one
+# process, so every access goes through this lock and keeps the file open only briefly.
+CACHE_LOCK = threading.Lock()
+
+
+@contextmanager
+def open_cache(name: str):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with CACHE_LOCK, shelve.open(os.path.join(CACHE_DIR, name)) as cache:
+        yield cache
+
+
+class CachedEmbeddings(Embeddings):
+    # Wraps an Embeddings object; only texts not seen before hit the model
+    def __init__(self, underlying: Embeddings, model_name: str):
+        self.underlying = underlying
+        self.model_name = model_name
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [f"{self.model_name}:{content_hash(t)}" for t in texts]
+        with open_cache("embeddings") as cache:
+            vectors = [cache.get(k) for k in keys]
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            new_vectors = self.underlying.embed_documents([texts[i] for i in missing])
+            with open_cache("embeddings") as cache:
+                for i, vec in zip(missing, new_vectors):
+                    vectors[i] = cache[keys[i]] = list(vec)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.underlying.embed_query(text)
 
 
 # -----------------------------
 # LLM + Vectorstore Setup
 # -----------------------------
+EMBED_BATCH_SIZE = 128
+
+
+class SentenceTransformerEmbeddings(Embeddings):
+    # Calls SentenceTransformer.encode directly so whole batches go through the model at once
+    def __init__(self, model_name: str):
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.model = SentenceTransformer(model_name, device=device)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.model.encode(
+            texts,
+            batch_size=EMBED_BATCH_SIZE,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        )
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+# Cached per process: Streamlit re-runs the app script but keeps imported modules,
+# so the MiniLM model and Groq client are loaded once and reused across uploads.
+@lru_cache(maxsize=None)
 def setup_llm():
-    return ChatGroq(model="llama3-8b-8192", temperature=0)
+    from langchain_groq import ChatGroq
+
+    return ChatGroq(model=LLM_MODEL, temperature=0, max_retries=LLM_MAX_RETRIES)
 
 
+@lru_cache(maxsize=None)
 def setup_embeddings():
-    return HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    return CachedEmbeddings(SentenceTransformerEmbeddings(EMBED_MODEL), EMBED_MODEL)
+
+
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 100
+
+
+def split_into_chunks(texts: List[str], paths: List[str]) -> List[LCDocument]:
+    # MiniLM truncates long inputs, so embed file chunks rather than whole files
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    return splitter.create_documents(texts, metadatas=[{"path": p} for p in paths])
+
+
+def build_vectorstore(docs: List[LCDocument], embed: Embeddings) -> FAISS:
+    import faiss
+
+    # Embed everything in one batched call and fill the FAISS index directly.
+    # Vectors are L2-normalized, so inner product == cosine similarity.
+    vectors = np.asarray(embed.embed_documents([d.page_content for d in docs]), dtype="float32")
+    faiss.normalize_L2(vectors)  # no-op for fresh vectors; guards cache entries from older runs
+    # Exact search on purpose: the index is built per run and queried once, so an ANN
+    # structure (HNSW/IVF) would cost more to build than it could ever save
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+
+    ids = [str(i) for i in range(len(docs))]
+    docstore = InMemoryDocstore(dict(zip(ids, docs)))
+    return FAISS(
+        embedding_function=embed,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=dict(enumerate(ids)),
+        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT,
+    )
 
 
 # -----------------------------
@@ -69,112 +218,267 @@ Provide:
 5. UI features (if any)
 6. Integrations (DB, APIs, auth, etc.)
 
-Base your answer on the indexed code."""
+Base your answer on the following excerpts from the codebase.
+
+# Code Excerpts
+{context}
+
+# Answer"""
     )
     retriever = vectorstore.as_retriever(search_kwargs={"k": 8})
     chain = prompt | llm
-    docs = retriever.get_relevant_documents("Give me a detailed overview of the codebase")
-    return chain.invoke({"input": docs}).content
+    docs = retriever.invoke("Give me a detailed overview of the codebase")
+    context = "\n\n".join(
+        f"## {d.metadata.get('path', 'unknown')}\n```\n{d.page_content}\n```" for d in docs
+    )
+    return chain.invoke({"context": context}).content
 
 
 # -----------------------------
 # File-by-File Analysis
 # -----------------------------
-def analyze_single_file(llm, filepath: str, content: str) -> str:
+MAX_FILE_CHARS = 4000  # safeguard against huge files
+# llama3-8b-8192 shares 8192 tokens between the prompt and all N analyses, so a batch
+# must leave room for every file's answer, not just fit its input.
+CONTEXT_TOKENS = 8192
+PROMPT_OVERHEAD_TOKENS = 400  # instructions + per-file headers
+OUTPUT_TOKENS_PER_FILE = 700
+MAX_BATCH_FILES = 6
+MAX_LLM_WORKERS = 8  # concurrent LLM requests (network-bound)
+NO_ANALYSIS = "_No analysis returned for this file._"
+LLM_MAX_RETRIES = 4  # Groq client retries rate limits/transient errors with backoff
+EXCERPT_CHARS = 1500  # raw code sent alongside the skeleton (imports, routes, config)
+
+SKELETON_LINE = re.compile(
+    r"^\s*(?:@\w|(?:export|public|private|protected|internal|static|abstract|final|async|default|pub)\s+)*"
+    r"(?:def|class|function|interface|struct|enum|trait|impl|func|fn|module|namespace|type)\b"
+    r"|^\s*@\w"
+    r"|\b(?:app|router|server)\.(?:get|post|put|patch|delete|use|route)\s*\("
+    r"|^(?://|/\*|#)"
+)
+
+
+def python_skeleton(code: str) -> str:
+    tree = ast.parse(code)
+    entries = []  # (line number, text), sorted at the end so comments interleave correctly
+
+    def first_doc_line(node) -> str:
+        doc = ast.get_docstring(node)
+        return doc.strip().splitlines()[0] if doc and doc.strip() else ""
+
+    def visit(nodes, indent: str):
+        for node in nodes:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                for dec in node.decorator_list:
+                    entries.append((dec.lineno, f"{indent}@{ast.unparse(dec)}"))
+                if isinstance(node, ast.ClassDef):
+                    bases = ", ".join(ast.unparse(b) for b in node.bases)
+                    entries.append((node.lineno, f"{indent}class {node.name}({bases}):"))
+                else:
+                    prefix = "async def" if isinstance(node, ast.AsyncFunctionDef) else "def"
+                    ret = f" -> {ast.unparse(node.returns)}" if node.returns else ""
+                    entries.append((node.lineno, f"{indent}{prefix} {node.name}({ast.unparse(node.args)}){ret}:"))
+                doc = first_doc_line(node)
+                if doc:
+                    entries.append((node.body[0].lineno, f'{indent}    """{doc}"""'))
+                visit(node.body, indent + "    ")
+            else:
+                # Definitions under if/try/with/for (e.g. "if TYPE_CHECKING:", ImportError
+                # fallbacks) count as well
+                for field in ("body", "orelse", "finalbody"):
+                    visit(getattr(node, field, []), indent)
+                for handler in getattr(node, "handlers", []):
+                    visit(handler.body, indent)
+
+    doc = first_doc_line(tree)
+    if doc:
+        entries.append((tree.body[0].lineno, f'"""{doc}"""'))
+    visit(tree.body, "")
+
+    # Top-level comments (column 0), found with tokenize so "#" inside strings is ignored
+    for tok in tokenize.generate_tokens(io.StringIO(code).readline):
+        if tok.type == tokenize.COMMENT and tok.start[1] == 0:
+            entries.append((tok.start[0], tok.string.rstrip()))
+
+    entries.sort(key=lambda entry: entry[0])
+    return "\n".join(text for _, text in entries)
+
+
+def extract_skeleton(code: str, ext: str) -> str:
+    # Signatures, class names, docstrings and top-level comments: most of the meaning, few tokens
+    if ext == ".py":
+        try:
+            return python_skeleton(code)
+        except (SyntaxError, ValueError, tokenize.TokenError):
+            pass
+    return "\n".join(line.rstrip() for line in code.splitlines() if SKELETON_LINE.search(line))
+
+
+def prepare_file_payload(filepath: str, content: str) -> str:
+    # Files that fit are sent whole; the skeleton is only worth it when it shrinks the payload
+    if len(content) <= MAX_FILE_CHARS:
+        return content
+    skeleton = extract_skeleton(content, os.path.splitext(filepath)[1])
+    if not skeleton.strip():
+        return content[:MAX_FILE_CHARS]
+    template = "# Structure\n{}\n\n# Excerpt\n{}"
+    room = MAX_FILE_CHARS - EXCERPT_CHARS - len(template.format("", ""))
+    return template.format(skeleton[:room], content[:EXCERPT_CHARS])
+
+
+def estimate_tokens(text: str) -> int:
+    # Code tokenizes denser than prose; ~3 chars per token errs on the safe side
+    return len(text) // 3 + 1
+
+
+def make_batches(items: List[Tuple[str, str]]) -> List[List[Tuple[str, str]]]:
+    batches, current, used = [], [], 0
+    for fp, content in items:
+        cost = estimate_tokens(content) + OUTPUT_TOKENS_PER_FILE
+        over_budget = PROMPT_OVERHEAD_TOKENS + used + cost > CONTEXT_TOKENS
+        if current and (over_budget or len(current) >= MAX_BATCH_FILES):
+            batches.append(current)
+            current, used = [], 0
+        current.append((fp, content))
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def analyze_file_batch(llm, items: List[Tuple[str, str]]) -> List[str]:
     prompt = ChatPromptTemplate.from_template(
         """You are a senior software engineer documenting a codebase.
-Analyze the following file and produce structured notes.
+Analyze each of the following {count} files and produce structured notes for every one of them.
 
-# File
-{filename}
-
-# Code
-{code}
+{files}
 
 # Instructions
+For EACH file, in order:
 1. State the purpose of this file.
 2. List important functions, classes, or components and their roles.
 3. Explain how it connects to other parts of the system.
 4. Note any API routes, UI elements, configs, or special patterns.
 5. Mention TODOs, risks, or tech debt if visible.
 
+Start the notes for file N with a line "## ANALYSIS N" (e.g. "## ANALYSIS 1") and
+produce exactly {count} such sections.
+
 # Answer"""
     )
-    trimmed = content[:4000]  # safeguard against huge files
-    ans = (prompt | llm).invoke({"filename": filepath, "code": trimmed}).content
-    return f"### {os.path.basename(filepath)}\n\n{ans.strip()}\n"
-
-
-def generate_file_by_file_doc(llm, project_root: str) -> str:
-    files = collect_code_files(project_root)
-    sections = ["## File-by-File Analysis\n"]
-    for fp in files[:50]:  # limit for performance
-        content = read_file(fp)
-        if not content.strip():
-            continue
-        sections.append(analyze_single_file(llm, fp, content))
-    return "\n".join(sections)
+    blocks = []
+    for i, (fp, content) in enumerate(items, 1):
+        blocks.append(f"### FILE {i}: {fp}\n```\n{content}\n```")
+    ans = (prompt | llm).invoke({"count": len(items), "files": "\n\n".join(blocks)}).content
+
+    # Split on the section markers; anything before the first marker is preamble
+    parts = re.split(
+        r"^[ \t#*]*ANALYSIS[ \t]+(\d+)\b.*$", ans, flags=re.MULTILINE | re.IGNORECASE
+    )
+    found = {}
+    for num, body in zip(parts[1::2], parts[2::2]):
+        found.setdefault(int(num), body.strip())
+
+    return [found.get(i) or NO_ANALYSIS for i in range(1, len(items) + 1)]
+
+
+def analyze_files(llm, items: List[Tuple[str, str]]) -> List[str]:
+    # Identical files (by content hash) reuse earlier analyses; only misses go to the LLM
+    keys = [f"{LLM_MODEL}:{PROMPT_VERSION}:{content_hash(content)}" for _, content in items]
+    with open_cache("analyses") as cache:
+        analyses = [cache.get(k) for k in keys]
+    missing = [i for i, a in enumerate(analyses) if a is None]
+    batches = make_batches([(items[i][0], prepare_file_payload(*items[i])) for i in missing])
+    if not batches:
+        return analyses
+
+    # Batches are network-bound, so fire them concurrently. Each batch is cached as soon
+    # as it returns, so work already paid for survives a later failure. Rate limits and
+    # transient errors are retried inside the Groq client; anything reaching us is final.
+    failures = []
+    with ThreadPoolExecutor(max_workers=min(MAX_LLM_WORKERS, len(batches))) as executor:
+        futures, start = {}, 0
+        for batch in batches:
+            futures[executor.submit(analyze_file_batch, llm, batch)] = missing[start:start + len(batch)]
+            start += len(batch)
+        for future in as_completed(futures):
+            indices = futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                logger.warning("File analysis failed for %s: %s", [items[i][0] for i in indices], e)
+                failures.append(e)
+                results = [NO_ANALYSIS] * len(indices)
+            with open_cache("analyses") as cache:
+                for i, analysis in zip(indices, results):
+                    analyses[i] = analysis
+                    if analysis != NO_ANALYSIS:
+                        cache[keys[i]] = analysis
+
+    # A document made only of placeholders would look like success; surface the real error
+    if len(failures) == len(batches):
+        raise RuntimeError(f"All {len(batches)} file analysis requests failed: {failures[-1]}") from failures[-1]
+    return analyses
+
+
+def generate_file_by_file_doc(llm, sources: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    items = sources[:50]  # limit for performance
+    return list(zip([fp for fp, _ in items], analyze_files(llm, items)))
 
 
 # -----------------------------
 # Main Function
 # -----------------------------
-def generate_functional_doc(zip_path: str, output_dir: str = "output") -> str:
+def generate_functional_doc(zip_source: ZipSource, output_dir: str = "output") -> str:
+    from docx import Document
+
     if os.path.exists(output_dir):
         shutil.rmtree(output_dir)
     os.makedirs(output_dir, exist_ok=True)
 
-    workdir = tempfile.mkdtemp()
-    unzip_project(zip_path, os.path.join(workdir, "repo"))
+    # Collect code
+    sources = read_zip_sources(zip_source)
+    if not sources:
+        raise ValueError("No source files found in the uploaded project.")
 
     # Setup LLM + embeddings
     llm = setup_llm()
     embed = setup_embeddings()
 
-    # Collect code
-    files = collect_code_files(os.path.join(workdir, "repo"))
-    texts = [read_file(f) for f in files if read_file(f).strip()]
-    if not texts:
-        raise ValueError("No source files found in the uploaded project.")
-
     # Build vectorstore
-    vectorstore = FAISS.from_texts(texts, embed)
+    paths = [path for path, _ in sources]
+    texts = [content for _, content in sources]
+    vectorstore = build_vectorstore(split_into_chunks(texts, paths), embed)
 
-    # Generate documentation parts
+    # Generate documentation parts; Markdown and DOCX are filled side by side
     md_parts = []
+    doc = Document()
 
     # 1. Project Overview
-    md_parts.append("# Project Functional Documentation\n")
     overview = generate_overview(llm, vectorstore)
+    md_parts.append("# Project Functional Documentation\n")
     md_parts.append("## Overview\n" + overview + "\n")
-
-    # 2. File-by-File Analysis
-    file_analysis_md = generate_file_by_file_doc(llm, os.path.join(workdir, "repo"))
-    md_parts.append(file_analysis_md)
-
-    # Save as Markdown
-    md_content = "\n".join(md_parts)
-    md_path = os.path.join(output_dir, "functional_doc.md")
-    with open(md_path, "w", encoding="utf-8") as f:
-        f.write(md_content)
-
-    # Save as DOCX
-    doc = Document()
     doc.add_heading("Project Functional Documentation", 0)
     doc.add_heading("Overview", level=1)
     doc.add_paragraph(overview)
 
+    # 2. File-by-File Analysis
+    md_parts.append("## File-by-File Analysis\n")
     doc.add_heading("File-by-File Analysis", level=1)
-    for fp in collect_code_files(os.path.join(workdir, "repo"))[:50]:
-        content = read_file(fp)
-        if not content.strip():
-            continue
-        analysis = analyze_single_file(llm, fp, content)
-        doc.add_heading(os.path.basename(fp), level=2)
+    for fp, analysis in generate_file_by_file_doc(llm, sources):
+        name = os.path.basename(fp)
+        md_parts.append(f"### {name}\n\n{analysis}\n")
+        doc.add_heading(name, level=2)
         for para in analysis.split("\n\n"):
             if para.strip():
                 doc.add_paragraph(para)
 
+    # Save as Markdown
+    md_path = os.path.join(output_dir, "functional_doc.md")
+    with open(md_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(md_parts))
+
+    # Save as DOCX
     doc_path = os.path.join(output_dir, "functional_doc.docx")
     doc.save(doc_path)
 